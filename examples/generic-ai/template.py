@@ -12,20 +12,89 @@ This template provides:
 """
 
 import os
+import re
+import atexit
+import builtins
 import json
 import subprocess
+import threading
 import time
 import logging
-from typing import Dict, Any, Optional, List, Callable
-from enum import Enum
+import functools
+import types
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Set, Tuple, Callable
+from enum import IntEnum
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 
-class RiskLevel(Enum):
-    LOW = "low"
-    MEDIUM = "medium" 
-    HIGH = "high"
-    CRITICAL = "critical"
+# orjson is optional; hook payloads fall back to the stdlib encoder.
+# Payloads are encoded straight to bytes for writing to afk's stdin.
+try:
+    import orjson
+    
+    def _dumpb(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    def _dumpb(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+
+# Process identity, looked up once rather than per AFKIntegration
+_PID = os.getpid()
+
+def _refresh_pid():
+    global _PID
+    _PID = os.getpid()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_refresh_pid)
+
+# Fire-and-forget notification processes with their monotonic deadlines,
+# reaped once they finish
+_background_procs: List[Tuple[subprocess.Popen, float]] = []
+_background_lock = threading.Lock()
+
+def _reap_background_procs():
+    """Collect exit statuses of finished notification processes"""
+    with _background_lock:
+        _background_procs[:] = [entry for entry in _background_procs if entry[0].poll() is None]
+
+def _kill_if_running(proc: subprocess.Popen):
+    """Kill a notification process that outlived its deadline"""
+    if proc.poll() is None:
+        proc.kill()
+        proc.wait()
+
+def _wait_background_procs():
+    """Let notification processes finish at exit, killing any past their deadline"""
+    with _background_lock:
+        procs, _background_procs[:] = list(_background_procs), []
+    for proc, deadline in procs:
+        try:
+            proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            _kill_if_running(proc)
+
+atexit.register(_wait_background_procs)
+
+class RiskLevel(IntEnum):
+    # Ordered by severity; values double as indexes into ApprovalPolicy's decision table
+    LOW = 0
+    MEDIUM = 1
+    HIGH = 2
+    CRITICAL = 3
+    
+    @property
+    def label(self) -> str:
+        return self.name.lower()
+    
+    @classmethod
+    def _missing_(cls, value):
+        # Accept the former string values, e.g. RiskLevel("low")
+        if isinstance(value, str):
+            return cls.__members__.get(value.upper())
+        return None
 
 @dataclass
 class ActionResult:
@@ -37,12 +106,25 @@ class ActionResult:
 class AFKIntegration:
     """Core AFK integration using subprocess calls"""
     
-    def __init__(self, session_id: str = None, timeout: int = 300):
-        self.session_id = session_id or f"ai-{os.getpid()}"
-        self.cwd = os.getcwd()
+    # Notification hooks are killed after this many seconds; in remote mode
+    # afk would otherwise keep waiting on Telegram for hours
+    NOTIFY_TIMEOUT = 30
+    
+    def __init__(self, session_id: str = None, timeout: int = 300, cwd: str = None):
+        self.session_id = session_id or f"ai-{_PID}"
+        self.cwd = cwd or os.getcwd()
         self.timeout = timeout
         self.logger = logging.getLogger(f"afk.{self.session_id}")
-        
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Return the thread pool used for non-blocking approval requests"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="afk-approval")
+            return self._executor
+    
     def request_approval(self, action_name: str, action_params: Dict[str, Any]) -> bool:
         """Request approval for an action using afk binary"""
         hook_input = {
@@ -54,27 +136,38 @@ class AFKIntegration:
         }
         
         try:
-            result = subprocess.run(
+            with subprocess.Popen(
                 ['afk', 'hook', 'pretooluse'],
-                input=json.dumps(hook_input, indent=2),
-                text=True,
-                capture_output=True,
-                timeout=self.timeout
-            )
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            ) as proc:
+                try:
+                    # Writing the input counts against the same deadline
+                    proc.communicate(_dumpb(hook_input), timeout=self.timeout)
+                finally:
+                    # Never leave afk running, whatever interrupted us
+                    if proc.poll() is None:
+                        proc.kill()
+                        proc.wait()
             
             # Return codes: 0=approved, 2=denied, 1=error
-            return result.returncode == 0
+            return proc.returncode == 0
             
         except subprocess.TimeoutExpired:
-            self.logger.warning(f"Approval timeout for {action_name}")
+            self.logger.warning("Approval timeout for %s", action_name)
             return False
         except FileNotFoundError:
             self.logger.error("AFK binary not found. Install with: npm install -g @probelabs/afk")
             return False
         except Exception as e:
-            self.logger.error(f"AFK integration error: {e}")
+            self.logger.error("AFK integration error: %s", e)
             return False
     
+    def request_approval_async(self, action_name: str, action_params: Dict[str, Any]) -> "Future[bool]":
+        """Request approval without blocking the caller; the future resolves to the decision"""
+        return self._get_executor().submit(self.request_approval, action_name, action_params)
+    
     def notify_session_start(self):
         """Notify AFK of session start"""
         hook_input = {
@@ -83,16 +176,7 @@ class AFKIntegration:
             "transcript_path": f"/tmp/{self.session_id}.jsonl"
         }
         
-        try:
-            subprocess.run(
-                ['afk', 'hook', 'sessionstart'],
-                input=json.dumps(hook_input),
-                text=True,
-                capture_output=True,
-                timeout=30
-            )
-        except Exception:
-            pass  # Silently fail for notifications
+        self._notify('sessionstart', hook_input)
     
     def notify_session_end(self):
         """Notify AFK of session completion"""
@@ -102,83 +186,208 @@ class AFKIntegration:
             "stop_hook_active": True
         }
         
+        self._notify('stop', hook_input)
+    
+    def _notify(self, event: str, hook_input: Dict[str, Any]):
+        """Send a notification hook without waiting for afk to handle it"""
         try:
-            subprocess.run(
-                ['afk', 'hook', 'stop'],
-                input=json.dumps(hook_input),
-                text=True,
-                capture_output=True,
-                timeout=30
+            proc = subprocess.Popen(
+                ['afk', 'hook', event],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
             )
         except Exception:
-            pass  # Silently fail for notifications
+            return  # Silently fail for notifications
+        
+        try:
+            proc.stdin.write(_dumpb(hook_input))
+            proc.stdin.close()
+        except Exception:
+            pass
+        
+        deadline = time.monotonic() + self.NOTIFY_TIMEOUT
+        timer = threading.Timer(self.NOTIFY_TIMEOUT, _kill_if_running, (proc,))
+        timer.daemon = True
+        timer.start()
+        
+        _reap_background_procs()
+        with _background_lock:
+            _background_procs.append((proc, deadline))
+    
+    def shutdown(self):
+        """Wait for pending approval requests"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
 
 class RiskAssessor:
     """Configurable risk assessment for AI actions"""
     
-    def __init__(self):
-        self.risk_patterns = {
-            RiskLevel.CRITICAL: [
-                r'rm\s+-rf\s+/',
-                r'format\s+c:',
-                r'del.*\*.*',
-                r'DROP\s+DATABASE',
-            ],
-            RiskLevel.HIGH: [
-                r'rm\s+',
-                r'delete.*file',
-                r'execute.*code',
-                r'shell.*command',
-                r'subprocess',
-                r'eval\(',
-                r'exec\(',
-            ],
-            RiskLevel.MEDIUM: [
-                r'write.*file',
-                r'modify.*config',
-                r'network.*request',
-                r'http.*request',
-                r'install.*package',
-            ],
-            RiskLevel.LOW: [
-                r'read.*file',
-                r'analyze.*data',
-                r'calculate',
-                r'search',
-                r'list.*dir',
-            ]
-        }
+    # Number of distinct action texts whose pattern scan result is remembered;
+    # longer texts (file bodies, code) are scanned every time rather than kept
+    SCAN_CACHE_SIZE = 4096
+    SCAN_CACHE_MAX_CHARS = 1024
+    
+    # Literal substrings that imply a match of these patterns, for the
+    # critical needle precheck in _scan()
+    PATTERN_NEEDLES = {
+        r'rm\s+-rf\s+/': "rm -rf /",
+        r'format\s+c:': "format c:",
+        r'DROP\s+DATABASE': "drop database",
+    }
+    
+    def __init__(self, risk_patterns: Optional[Dict[RiskLevel, List[str]]] = None):
+        if risk_patterns is None:
+            risk_patterns = {
+                RiskLevel.CRITICAL: [
+                    r'rm\s+-rf\s+/',
+                    r'format\s+c:',
+                    r'del.*\*.*',
+                    r'DROP\s+DATABASE',
+                ],
+                RiskLevel.HIGH: [
+                    r'rm\s+',
+                    r'delete.*file',
+                    r'execute.*code',
+                    r'shell.*command',
+                    r'subprocess',
+                    r'eval\(',
+                    r'exec\(',
+                ],
+                RiskLevel.MEDIUM: [
+                    r'write.*file',
+                    r'modify.*config',
+                    r'network.*request',
+                    r'http.*request',
+                    r'install.*package',
+                ],
+                RiskLevel.LOW: [
+                    r'read.*file',
+                    r'analyze.*data',
+                    r'calculate',
+                    r'search',
+                    r'list.*dir',
+                ]
+            }
+        self.risk_patterns = risk_patterns
+        
+        # Each level's patterns are fused into one compiled alternation. They are
+        # compiled from a snapshot of risk_patterns, and recompiled on the next
+        # scan if risk_patterns has been edited since.
+        self._scan_cached = functools.lru_cache(maxsize=self.SCAN_CACHE_SIZE)(self._scan)
+        self._compile_patterns()
+        
+        # Known-safe action names, assessed as LOW without scanning params
+        self.safe_actions: Set[str] = set()
         
         # Custom risk assessors (functions that take action_name, params and return RiskLevel)
         self.custom_assessors: List[Callable[[str, Dict], Optional[RiskLevel]]] = []
     
     def assess(self, action_name: str, action_params: Dict[str, Any]) -> RiskLevel:
         """Assess risk level of an action"""
+        risk = self._assess_without_patterns(action_name, action_params)
+        if risk is not None:
+            return risk
+        
+        # Check against patterns
+        return self._scan_text(self._action_text(action_name, action_params))
+    
+    def _assess_without_patterns(self, action_name: str, action_params: Dict[str, Any]) -> Optional[RiskLevel]:
+        """Assess an action from safe_actions and custom assessors alone"""
+        if action_name in self.safe_actions:
+            return RiskLevel.LOW
         
         # Try custom assessors first
         for assessor in self.custom_assessors:
             risk = assessor(action_name, action_params)
-            if risk:
+            if risk is not None:
                 return risk
         
-        # Check against patterns
-        action_text = f"{action_name} {json.dumps(action_params)}".lower()
+        return None
+    
+    def _scan_text(self, action_text: str) -> RiskLevel:
+        """Scan action text, using the cache only for short texts"""
+        if self.risk_patterns != self._compiled_patterns:
+            self._compile_patterns()
+        if len(action_text) > self.SCAN_CACHE_MAX_CHARS:
+            return self._scan(action_text)
+        return self._scan_cached(action_text)
+    
+    def _scan(self, action_text: str) -> RiskLevel:
+        """Match action text against the risk patterns, highest risk first"""
+        # Plain substring search is much cheaper than the regex engine
+        for needle in self._critical_needles:
+            if needle in action_text:
+                return RiskLevel.CRITICAL
         
-        import re
-        for risk_level, patterns in self.risk_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, action_text, re.IGNORECASE):
-                    return risk_level
+        for risk_level, level_re in self._scan_order:
+            if level_re.search(action_text):
+                return risk_level
         
         # Default to medium risk for unknown actions
         return RiskLevel.MEDIUM
     
+    def _action_text(self, action_name: str, action_params: Dict[str, Any]) -> str:
+        """Build the text scanned by risk patterns from the action name and params"""
+        parts = [action_name]
+        for key, value in action_params.items():
+            parts.append(f"{key} {value}")
+        return " ".join(parts).lower()
+    
+    def _compile_patterns(self):
+        """Compile risk_patterns and remember the snapshot they came from"""
+        snapshot = {level: list(patterns) for level, patterns in self.risk_patterns.items()}
+        # Scanned from most to least severe; empty levels would match everything
+        self._scan_order = sorted(
+            ((level, self._compile_level(patterns)) for level, patterns in snapshot.items() if patterns),
+            key=lambda item: item[0],
+            reverse=True
+        )
+        # Literals implied by the critical patterns, checked before any regex runs
+        self._critical_needles = self._build_critical_needles(snapshot.get(RiskLevel.CRITICAL, []))
+        self._compiled_patterns = snapshot
+        self._scan_cached.cache_clear()
+    
+    def _build_critical_needles(self, critical_patterns: List[str]) -> Tuple[str, ...]:
+        """Collect literal substrings that imply a CRITICAL pattern"""
+        needles = []
+        for pattern in critical_patterns:
+            if pattern in self.PATTERN_NEEDLES:
+                needles.append(self.PATTERN_NEEDLES[pattern])
+            elif not any(char in pattern for char in ".^$*+?{}[]\\|()"):
+                needles.append(pattern.lower())
+        return tuple(needles)
+    
+    @staticmethod
+    def _compile_level(patterns: List[str]) -> re.Pattern:
+        """Combine a level's patterns into a single alternation regex"""
+        # DOTALL lets '.' span newlines in raw param values, as it did over
+        # their escaped form when params were JSON-encoded
+        return re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE | re.DOTALL)
+    
+    def add_pattern(self, risk_level: RiskLevel, pattern: str):
+        """Add a regex pattern for a risk level"""
+        self.risk_patterns.setdefault(risk_level, []).append(pattern)
+        self._compile_patterns()
+    
     def add_custom_assessor(self, assessor: Callable[[str, Dict], Optional[RiskLevel]]):
         """Add custom risk assessor function"""
         self.custom_assessors.append(assessor)
 
+
 class ApprovalPolicy:
-    """Configurable approval policy"""
+    """Configurable approval policy
+    
+    require_approval and auto_deny are folded into a per-risk-level decision
+    table, which is rebuilt lazily whenever either of them has changed.
+    """
+    
+    # Per-risk-level decisions
+    AUTO_APPROVE = 0
+    REQUEST = 1
+    AUTO_DENY = 2
     
     def __init__(self):
         # Which risk levels require approval
@@ -194,12 +403,47 @@ class ApprovalPolicy:
         
         # Auto-approve based on conditions
         self.auto_approve_conditions: List[Callable[[str, Dict], bool]] = []
+        
+        self._rebuild_policy_table()
+    
+    def set_requirement(self, risk: RiskLevel, required: bool):
+        """Set whether actions at this risk level require approval"""
+        self.require_approval[risk] = required
+    
+    def deny(self, risk: RiskLevel, denied: bool = True):
+        """Set whether actions at this risk level are denied outright"""
+        if denied:
+            self.auto_deny.add(risk)
+        else:
+            self.auto_deny.discard(risk)
+    
+    def _rebuild_policy_table(self):
+        """Precompute the decision for each risk level"""
+        self._table_require = dict(self.require_approval)
+        self._table_deny = set(self.auto_deny)
+        self._policy_table = tuple(
+            self.AUTO_DENY if risk in self._table_deny
+            else self.REQUEST if self._table_require.get(risk, True)
+            else self.AUTO_APPROVE
+            for risk in RiskLevel
+        )
+    
+    def _decision(self, risk: RiskLevel) -> int:
+        """Look up the decision for a risk level, rebuilding the table if the policy changed"""
+        if self.require_approval != self._table_require or self.auto_deny != self._table_deny:
+            self._rebuild_policy_table()
+        return self._policy_table[risk]
+    
+    def is_auto_denied(self, risk: RiskLevel) -> bool:
+        """Check if actions at this risk level are denied outright"""
+        return self._decision(risk) == self.AUTO_DENY
     
     def should_request_approval(self, risk: RiskLevel, action_name: str, params: Dict) -> bool:
         """Check if approval should be requested"""
+        state = self._decision(risk)
         
         # Auto-deny critical actions
-        if risk in self.auto_deny:
+        if state == self.AUTO_DENY:
             return False
         
         # Check auto-approve conditions
@@ -207,7 +451,7 @@ class ApprovalPolicy:
             if condition(action_name, params):
                 return False
         
-        return self.require_approval.get(risk, True)
+        return state == self.REQUEST
     
     def add_auto_approve_condition(self, condition: Callable[[str, Dict], bool]):
         """Add condition for auto-approval"""
@@ -221,16 +465,12 @@ class BaseAIAgent(ABC):
         self.risk_assessor = RiskAssessor()
         self.approval_policy = ApprovalPolicy()
         self.logger = logging.getLogger(self.__class__.__name__)
-        
-        # Configure logging
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
         
         # Start session
         self.afk.notify_session_start()
-        self.logger.info(f"AI Agent started with session: {self.afk.session_id}")
+        self.logger.info("AI Agent started with session: %s", self.afk.session_id)
         
         # Custom initialization
         self.initialize(**kwargs)
@@ -246,15 +486,15 @@ class BaseAIAgent(ABC):
         try:
             # Assess risk
             risk = self.risk_assessor.assess(action_name, action_params)
-            self.logger.info(f"Action '{action_name}' assessed as {risk.value} risk")
+            self.logger.info("Action '%s' assessed as %s risk", action_name, risk.label)
             
             # Check approval policy
             if not self.approval_policy.should_request_approval(risk, action_name, action_params):
-                if risk in self.approval_policy.auto_deny:
-                    self.logger.warning(f"Action '{action_name}' auto-denied due to {risk.value} risk")
+                if self.approval_policy.is_auto_denied(risk):
+                    self.logger.warning("Action '%s' auto-denied due to %s risk", action_name, risk.label)
                     return ActionResult(success=False, approved=False, error="Auto-denied due to critical risk")
                 else:
-                    self.logger.info(f"Action '{action_name}' auto-approved")
+                    self.logger.info("Action '%s' auto-approved", action_name)
                     result = self._perform_action(action_name, action_params)
                     return ActionResult(success=True, approved=True, result=result)
             
@@ -262,17 +502,32 @@ class BaseAIAgent(ABC):
             approved = self.afk.request_approval(action_name, action_params)
             
             if approved:
-                self.logger.info(f"Action '{action_name}' approved by user")
+                self.logger.info("Action '%s' approved by user", action_name)
                 result = self._perform_action(action_name, action_params)
                 return ActionResult(success=True, approved=True, result=result)
             else:
-                self.logger.info(f"Action '{action_name}' denied by user")
+                self.logger.info("Action '%s' denied by user", action_name)
                 return ActionResult(success=False, approved=False, error="User denied action")
                 
         except Exception as e:
-            self.logger.error(f"Error executing action '{action_name}': {e}")
+            self.logger.error("Error executing action '%s': %s", action_name, e)
             return ActionResult(success=False, approved=False, error=str(e))
     
+    def execute_action_async(self, action_name: str, action_params: Dict[str, Any]) -> "Future[ActionResult]":
+        """Execute an action in the background; the future resolves to its ActionResult
+        
+        Lets an agent keep working, or run several independent actions with
+        concurrent.futures.as_completed(), while approvals are pending.
+        """
+        return self._get_executor().submit(self.execute_action, action_name, action_params)
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Return the thread pool used for background actions"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="afk-action")
+            return self._executor
+    
     @abstractmethod
     def _perform_action(self, action_name: str, action_params: Dict[str, Any]) -> Any:
         """Perform the actual action (implement in subclass)"""
@@ -281,15 +536,26 @@ class BaseAIAgent(ABC):
     def shutdown(self):
         """Clean shutdown"""
         self.logger.info("Shutting down AI agent")
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
         self.afk.notify_session_end()
+        self.afk.shutdown()
 
 # Example implementation
 class ExampleAIAgent(BaseAIAgent):
     """Example AI agent implementation"""
     
+    # Number of compiled execute_code snippets kept for reuse
+    CODE_CACHE_SIZE = 128
+    
     def initialize(self, **kwargs):
         """Configure the example agent"""
         
+        self._code_cache: "OrderedDict[str, types.CodeType]" = OrderedDict()
+        self._code_cache_lock = threading.Lock()
+        
         # Add custom risk assessor
         def custom_risk_assessor(action_name: str, params: Dict) -> Optional[RiskLevel]:
             # Example: always treat file operations in /tmp as low risk
@@ -299,10 +565,12 @@ class ExampleAIAgent(BaseAIAgent):
         
         self.risk_assessor.add_custom_assessor(custom_risk_assessor)
         
-        # Add auto-approve condition
+        # Read-only operations are assessed as low risk without scanning their params
+        read_only_actions = {"read_file", "list_directory", "analyze_data"}
+        self.risk_assessor.safe_actions.update(read_only_actions)
+        
+        # ...and auto-approved even under a policy that requires approval for low risk
         def auto_approve_read_only(action_name: str, params: Dict) -> bool:
-            # Auto-approve read-only operations
-            read_only_actions = ["read_file", "list_directory", "analyze_data"]
             return action_name in read_only_actions
         
         self.approval_policy.add_auto_approve_condition(auto_approve_read_only)
@@ -319,7 +587,7 @@ class ExampleAIAgent(BaseAIAgent):
             
         elif action_name == "execute_code":
             code = action_params["code"]
-            exec(code)
+            exec(self._compile_code(code), {"__builtins__": builtins})
             return "Code executed successfully"
             
         elif action_name == "shell_command":
@@ -337,6 +605,19 @@ class ExampleAIAgent(BaseAIAgent):
         
         else:
             return f"Unknown action: {action_name}"
+    
+    def _compile_code(self, code: str) -> types.CodeType:
+        """Compile a code snippet, reusing the result for repeated snippets"""
+        with self._code_cache_lock:
+            compiled = self._code_cache.get(code)
+            if compiled is None:
+                compiled = compile(code, "<agent>", "exec")
+                self._code_cache[code] = compiled
+                if len(self._code_cache) > self.CODE_CACHE_SIZE:
+                    self._code_cache.popitem(last=False)
+            else:
+                self._code_cache.move_to_end(code)
+            return compiled
 
 def demo():
     """Demonstrate the generic AI agent template"""
@@ -380,6 +661,11 @@ def demo():
         agent.shutdown()
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
     print("🚀 Generic AI Agent Template with AFK Integration")
     print("This template shows how to integrate any AI system with AFK remote control")
     print("Make sure you have AFK installed: npm install -g @probelabs/afk")